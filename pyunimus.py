@@ -1,31 +1,92 @@
 #!/usr/bin/env python3
 import os
+import re
 import sys
-import base64
+import time
+import signal
+import threading
+import functools
 import subprocess
-import requests
+import pybase64
+import httpx
+import orjson
 from datetime import datetime
 from pathlib import Path
+from typing import Callable, Iterator
 from dotenv import load_dotenv
+import queue
+from collections import deque
 import logging
+from logging.handlers import QueueHandler, QueueListener
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
+# Records are formatted by the queue handler and written out by a background listener thread
+log_queue = queue.Queue(-1)
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s [%(levelname)s] %(message)s",
     datefmt="%Y-%m-%d %H:%M:%S",
-    handlers=[
-        logging.FileHandler("pyunimus.log"),
-        logging.StreamHandler(sys.stdout)
-    ]
+    handlers=[QueueHandler(log_queue)]
+)
+log_listener = QueueListener(
+    log_queue,
+    logging.FileHandler("pyunimus.log"),
+    logging.StreamHandler(sys.stdout)
 )
 
 logger = logging.getLogger(__name__)
+# httpx logs every request at INFO; keep the log to the exporter's own messages
+logging.getLogger("httpx").setLevel(logging.WARNING)
 
 # Global variables (will be set during initialization)
 devices = {}
+config = {}
+api_url = ""
 script_dir = ""
 backup_dir = ""
 
+# Set on SIGTERM to end the run loop once the current export has finished
+stop_event = threading.Event()
+
+# Number of concurrent API requests when exporting all backups
+MAX_WORKERS = 16
+
+# Responses retried by unimus_get, how many times, and the base delay in seconds (doubled on each attempt)
+RETRY_STATUSES = {502, 503, 504}
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.2
+
+# Number of items requested per page from the Unimus API (the API's maximum)
+PAGE_SIZE = 1000
+
+# Size of each base64 slice decoded while writing a backup (must be a multiple of 4)
+DECODE_CHUNK_SIZE = 64 * 1024
+
+# Matches the line breaks and other whitespace of line-wrapped (MIME-style) base64
+BASE64_WHITESPACE = re.compile(r"\s")
+
+# Format used for backup timestamps in file names
+BACKUP_DATE_FORMAT = "%Y-%m-%d-%H:%M:%S"
+
+# File extension for each backup type; unlisted types are saved as binary
+BACKUP_EXTENSIONS = {"TEXT": "txt"}
+
+# Prefix for backups being written; they are renamed into place once complete
+TEMP_FILE_PREFIX = ".tmp."
+
+# Git invocation for the backup repository: skip fsync of every object written and never auto-gc mid-export
+GIT_COMMAND = ["git", "-c", "core.fsync=none", "-c", "gc.auto=0"]
+
+# Shared HTTP/2 client so every API call is multiplexed over the same connection
+CLIENT = httpx.Client(
+    timeout=30,
+    transport=httpx.HTTPTransport(
+        http2=True,
+        retries=3,
+        limits=httpx.Limits(max_connections=MAX_WORKERS, max_keepalive_connections=MAX_WORKERS),
+    ),
+)
+
 def error_check(status: int, message: str) -> None:
     """Check the exit status and exit the program if an error is detected.
     
@@ -40,7 +101,8 @@ def error_check(status: int, message: str) -> None:
 def unimus_get(api_endpoint: str) -> dict:
     """Fetch JSON data from the Unimus API for a given endpoint.
     
-    Constructs the URL using the base server address from the configuration and sends an HTTP GET request.
+    Appends the endpoint to the API base URL built during initialization and sends an HTTP GET request, retrying
+    with backoff when the server answers with a transient gateway error.
     
     Args:
         api_endpoint (str): The API endpoint to query (e.g., 'health', 'devices?page=0').
@@ -51,18 +113,40 @@ def unimus_get(api_endpoint: str) -> dict:
     Raises:
         SystemExit: If the HTTP request fails.
     """
-    url = f"{os.getenv('unimus_server_address').rstrip('/')}/api/v2/{api_endpoint}"
-    headers = {
-        "Accept": "application/json",
-        "Authorization": f"Bearer {os.getenv('unimus_api_key')}"
-    }
-    try:
-        response = requests.get(url, headers=headers, timeout=30)
-        response.raise_for_status()
-    except Exception as e:
-        logger.error("Unable to get data from unimus server")
-        sys.exit(1)
-    return response.json()
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            response = CLIENT.get(f"{api_url}/{api_endpoint}")
+            if response.status_code in RETRY_STATUSES and attempt < MAX_RETRIES:
+                time.sleep(RETRY_BACKOFF * 2 ** attempt)
+                continue
+            response.raise_for_status()
+        except Exception as e:
+            logger.error("Unable to get data from unimus server")
+            sys.exit(1)
+        return orjson.loads(response.content)
+
+def paged_prefetch(endpoint_fn: Callable[[int], str]) -> Iterator[list]:
+    """Yield the data of each page of a paginated Unimus API endpoint.
+    
+    While the caller processes one page, the next page is already being fetched in a background thread. Iteration
+    stops at the first page that returns no data.
+    
+    Args:
+        endpoint_fn (Callable[[int], str]): Builds the API endpoint for a page number (e.g., lambda page: f'devices?page={page}').
+    
+    Yields:
+        list: The 'data' items of each non-empty page.
+    """
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        page = 0
+        future = prefetcher.submit(unimus_get, endpoint_fn(page))
+        while True:
+            data_list = future.result().get("data", [])
+            if not data_list:
+                break
+            page += 1
+            future = prefetcher.submit(unimus_get, endpoint_fn(page))
+            yield data_list
 
 def unimus_status_check() -> str:
     """Check the health status of the Unimus server.
@@ -81,32 +165,84 @@ def unimus_status_check() -> str:
         sys.exit(1)
     return status
 
-def save_backup(device_id, backup_date, backup_b64, bkp_type) -> None:
+@functools.lru_cache(maxsize=4096)
+def fmt_ts(ts: int) -> str:
+    """Format a Unimus backup timestamp for use in a backup file name.
+    
+    Results are cached as many backups share the same timestamp.
+    
+    Args:
+        ts (int): Seconds since the epoch.
+    
+    Returns:
+        str: The local time formatted with BACKUP_DATE_FORMAT.
+    """
+    return time.strftime(BACKUP_DATE_FORMAT, time.localtime(ts))
+
+@functools.lru_cache(maxsize=None)
+def ensure_device_dir(device_id) -> tuple[Path, set[str]]:
+    """Create the backup directory for a device and list the backups already in it.
+    
+    The result is cached so the directory is created and scanned only once per device; callers add new file names
+    to the returned set as they write them. Temporary files left behind by an interrupted write are removed.
+    
+    Args:
+        device_id: The identifier for the device.
+    
+    Returns:
+        tuple[Path, set[str]]: The device's backup directory and the names of the files it contains.
+    """
+    address = devices.get(device_id, f"device-{device_id}")
+    device_dir = Path(backup_dir) / f"{address} - {device_id}"
+    device_dir.mkdir(parents=True, exist_ok=True)
+    existing = set()
+    with os.scandir(device_dir) as entries:
+        for entry in entries:
+            if entry.name.startswith(TEMP_FILE_PREFIX):
+                os.remove(entry.path)
+            else:
+                existing.add(entry.name)
+    return device_dir, existing
+
+def save_backup(device_id, backup_date, backup_b64, ext) -> None:
     """Save a backup for a device by decoding a base64-encoded string and writing it to disk.
     
-    The backup is saved in a directory named using the device's address and ID. The file extension is determined by the backup type.
+    The payload is decoded in slices into a temporary file, which is synced and renamed into the device's directory.
     
     Args:
         device_id: The identifier for the device.
         backup_date: The backup date as a formatted string.
         backup_b64: The backup data encoded in base64.
-        bkp_type: The type of backup ('TEXT' for text files, otherwise binary is assumed).
+        ext: The file extension for the backup (see BACKUP_EXTENSIONS).
     """
     address = devices.get(device_id, f"device-{device_id}")
-    ext = "txt" if bkp_type.upper() == "TEXT" else "bin"
     # Directory for the device backups
-    device_dir = Path(backup_dir) / f"{address} - {device_id}"
-    device_dir.mkdir(parents=True, exist_ok=True)
+    device_dir, existing = ensure_device_dir(device_id)
     # Construct backup file name
-    file_name = f"Backup {address} {backup_date} {device_id}.{ext}"
+    file_name = "Backup %s %s %s.%s" % (address, backup_date, device_id, ext)
+    if file_name in existing:
+        return
     backup_file = device_dir / file_name
-    if not backup_file.exists():
+    tmp_file = device_dir / f"{TEMP_FILE_PREFIX}{device_id}.{os.getpid()}"
+    try:
+        # Slicing relies on every character being part of the encoding
+        if BASE64_WHITESPACE.search(backup_b64):
+            backup_b64 = BASE64_WHITESPACE.sub("", backup_b64)
+        fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
         try:
-            backup_data = base64.b64decode(backup_b64)
-            with open(backup_file, "wb") as f:
-                f.write(backup_data)
-        except Exception as e:
-            logger.error(f"Failed to save backup for device {device_id}: {e}")
+            for offset in range(0, len(backup_b64), DECODE_CHUNK_SIZE):
+                chunk = memoryview(pybase64.b64decode(backup_b64[offset:offset + DECODE_CHUNK_SIZE], validate=False))
+                # os.write may write fewer bytes than given; keep going until the slice is on disk
+                while chunk:
+                    chunk = chunk[os.write(fd, chunk):]
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(tmp_file, backup_file)
+        existing.add(file_name)
+    except Exception as e:
+        logger.error(f"Failed to save backup for device {device_id}: {e}")
+        tmp_file.unlink(missing_ok=True)
 
 def get_all_devices() -> None:
     """Retrieve and store device information from the Unimus API.
@@ -114,77 +250,102 @@ def get_all_devices() -> None:
     The function fetches device data page by page and populates the global 'devices' dictionary.
     """
     logger.info("Getting Device Information")
-    page = 0
-    while True:
-        result = unimus_get(f"devices?page={page}")
-        data_list = result.get("data", [])
-        if not data_list:
-            break
+    for data_list in paged_prefetch(lambda page: f"devices?size={PAGE_SIZE}&page={page}"):
         for item in data_list:
             device_id = item.get("id")
             address = item.get("address")
             if device_id and address:
                 devices[device_id] = address
-        page += 1
+
+def device_backups() -> Iterator[tuple[int, dict]]:
+    """Yield every backup of every known device.
+    
+    Backup pages are fetched concurrently using a thread pool, with at most MAX_WORKERS requests outstanding so that
+    only a bounded number of fetched pages wait in memory. When a device's first page reports how many pages exist the
+    rest are queued ahead of other devices, otherwise pages are requested one after another until an empty page is
+    returned. Pages are processed in the order they arrive; on error, queued requests are cancelled.
+    
+    Yields:
+        tuple[int, dict]: The device ID and a backup record.
+    """
+    work = deque((device_id, 0) for device_id in devices.keys())
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        try:
+            pending = {}
+            while work or pending:
+                while work and len(pending) < MAX_WORKERS:
+                    device_id, page = work.popleft()
+                    future = executor.submit(unimus_get, f"devices/{device_id}/backups?size={PAGE_SIZE}&page={page}")
+                    pending[future] = (device_id, page)
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    device_id, page = pending.pop(future)
+                    result = future.result()
+                    data_list = result.get("data", [])
+                    if not data_list:
+                        continue
+                    total_pages = result.get("paginator", {}).get("totalPages")
+                    if total_pages is None:
+                        work.appendleft((device_id, page + 1))
+                    elif page == 0:
+                        work.extendleft((device_id, next_page) for next_page in range(total_pages - 1, 0, -1))
+                    for backup in data_list:
+                        yield device_id, backup
+        except BaseException:
+            executor.shutdown(cancel_futures=True)
+            raise
+
+def backup_fields(device_id, backup: dict) -> tuple:
+    """Extract the arguments for save_backup from a backup record returned by the API.
+    
+    Args:
+        device_id: The identifier for the device the backup belongs to.
+        backup (dict): The backup record, holding 'validSince', 'bytes' and 'type'.
+    
+    Returns:
+        tuple: The device ID, formatted backup date, base64 payload and file extension.
+    """
+    tme = backup.get("validSince")
+    backup_date = fmt_ts(tme) if tme else "unknown"
+    return device_id, backup_date, backup.get("bytes", ""), BACKUP_EXTENSIONS.get(backup.get("type", ""), "bin")
+
+def latest_backups() -> Iterator[tuple[int, dict]]:
+    """Yield the latest backup of every device, prefetching the next page while the current one is processed.
+    
+    Yields:
+        tuple[int, dict]: The device ID and a backup record.
+    """
+    for data_list in paged_prefetch(lambda page: f"devices/backups/latest?size={PAGE_SIZE}&page={page}"):
+        for item in data_list:
+            yield item.get("deviceId"), item.get("backup", {})
 
 def get_all_backups() -> None:
     """Fetch and save all backups for each device from the Unimus API.
     
-    Iterates through each device and their respective paginated backups, saving each backup to disk.
+    Pages are fetched concurrently by device_backups while backups are saved from the main thread.
     """
     backup_count = 0
-    for device_id in devices.keys():
-        page = 0
-        while True:
-            result = unimus_get(f"devices/{device_id}/backups?page={page}")
-            data_list = result.get("data", [])
-            if not data_list:
-                break
-            for item in data_list:
-                tme = item.get("validSince")
-                if tme:
-                    backup_date = datetime.fromtimestamp(tme).strftime("%Y-%m-%d-%H:%M:%S")
-                else:
-                    backup_date = "unknown"
-                backup_b64 = item.get("bytes", "")
-                bkp_type = item.get("type", "")
-                save_backup(device_id, backup_date, backup_b64, bkp_type)
-                backup_count += 1
-            page += 1
+    for device_id, backup in device_backups():
+        save_backup(*backup_fields(device_id, backup))
+        backup_count += 1
     logger.info(f"{backup_count} backups exported")
 
 def get_latest_backups() -> None:
     """Fetch and save the latest backups for all devices from the Unimus API.
     
-    Iterates through pages of the latest backups and saves each one to disk.
+    Pages are prefetched by latest_backups while backups are saved to disk.
     """
     backup_count = 0
-    page = 0
-    while True:
-        result = unimus_get(f"devices/backups/latest?page={page}")
-        data_list = result.get("data", [])
-        if not data_list:
-            break
-        for item in data_list:
-            device_id = item.get("deviceId")
-            backup_info = item.get("backup", {})
-            tme = backup_info.get("validSince")
-            if tme:
-                backup_date = datetime.fromtimestamp(tme).strftime("%Y-%m-%d-%H:%M:%S")
-            else:
-                backup_date = "unknown"
-            backup_b64 = backup_info.get("bytes", "")
-            bkp_type = backup_info.get("type", "")
-            save_backup(device_id, backup_date, backup_b64, bkp_type)
-            backup_count += 1
-        page += 1
+    for device_id, backup in latest_backups():
+        save_backup(*backup_fields(device_id, backup))
+        backup_count += 1
     logger.info(f"{backup_count} backups exported")
 
-def run_command(command, cwd=None) -> str:
-    """Execute a shell command and return its output.
+def run_command(command: list[str], cwd=None) -> str:
+    """Execute a command without a shell and return its output.
     
     Args:
-        command (str): The shell command to execute.
+        command (list[str]): The program and its arguments.
         cwd (str, optional): The working directory to run the command in. Defaults to None.
     
     Returns:
@@ -194,9 +355,9 @@ def run_command(command, cwd=None) -> str:
         SystemExit: If the command execution fails.
     """
     try:
-        result = subprocess.run(command, cwd=cwd, shell=True, capture_output=True, text=True)
+        result = subprocess.run(command, cwd=cwd, capture_output=True, text=True)
         if result.returncode != 0:
-            logger.error(f"Command failed: {command}\nStdout: {result.stdout}\nStderr: {result.stderr}")
+            logger.error(f"Command failed: {' '.join(command)}\nStdout: {result.stdout}\nStderr: {result.stderr}")
             sys.exit(result.returncode)
         return result.stdout.strip()
     except Exception as e:
@@ -211,47 +372,52 @@ def push_to_git() -> None:
     Raises:
         SystemExit: If any Git command fails.
     """
-    os.chdir(backup_dir)
     try:
-        inside_repo = run_command("git rev-parse --is-inside-work-tree")
+        inside_repo = run_command([*GIT_COMMAND, "rev-parse", "--is-inside-work-tree"], cwd=backup_dir)
     except Exception:
         inside_repo = ""
     if not inside_repo:
-        run_command("git init")
-        run_command("git add .")
-        run_command("git commit -m 'Initial Commit'")
-        protocol = os.getenv("git_server_protocol").lower()
+        run_command([*GIT_COMMAND, "init"], cwd=backup_dir)
+        run_command([*GIT_COMMAND, "add", "--all"], cwd=backup_dir)
+        run_command([*GIT_COMMAND, "commit", "-m", "Initial Commit"], cwd=backup_dir)
+        protocol = config["git_server_protocol"].lower()
+        username = config["git_username"]
+        password = config["git_password"]
+        server = config["git_server_address"]
+        repo_name = config["git_repo_name"]
         remote_url = ""
         if protocol == "ssh":
-            run_command(f"ssh-keyscan -H {os.getenv('git_server_address')} >> ~/.ssh/known_hosts")
-            if os.getenv("git_password", "") == "":
-                remote_url = f"ssh://{os.getenv('git_username')}@{os.getenv('git_server_address')}/{os.getenv('git_repo_name')}"
+            host_keys = run_command(["ssh-keyscan", "-H", server])
+            with open(os.path.expanduser("~/.ssh/known_hosts"), "a") as f:
+                f.write(host_keys + "\n")
+            if password == "":
+                remote_url = f"ssh://{username}@{server}/{repo_name}"
             else:
-                remote_url = f"ssh://{os.getenv('git_username')}:{os.getenv('git_password')}@{os.getenv('git_server_address')}/{os.getenv('git_repo_name')}"
+                remote_url = f"ssh://{username}:{password}@{server}/{repo_name}"
         elif protocol in ["http", "https"]:
-            remote_url = f"{protocol}://{os.getenv('git_username')}:{os.getenv('git_password')}@{os.getenv('git_server_address')}:{os.getenv('git_port')}/{os.getenv('git_repo_name')}"
+            remote_url = f"{protocol}://{username}:{password}@{server}:{config['git_port']}/{repo_name}"
         else:
             logger.error("Invalid setting for git_server_protocol")
             sys.exit(2)
-        run_command(f"git remote add origin {remote_url}")
-        run_command(f"git push -u origin {os.getenv('git_branch')} >> {log_file_path}")
-        run_command("git push >> " + log_file_path)
+        run_command([*GIT_COMMAND, "remote", "add", "origin", remote_url], cwd=backup_dir)
+        run_command([*GIT_COMMAND, "push", "-u", "origin", config["git_branch"]], cwd=backup_dir)
+        run_command([*GIT_COMMAND, "push"], cwd=backup_dir)
     else:
-        run_command("git add --all")
+        run_command([*GIT_COMMAND, "add", "--all"], cwd=backup_dir)
         commit_message = f"Unimus Git Extractor {datetime.now().strftime('%b-%d-%y %H:%M')}"
-        run_command(f"git commit -m \"{commit_message}\"")
-        run_command("git push")
-    os.chdir(script_dir)
+        run_command([*GIT_COMMAND, "commit", "-m", commit_message], cwd=backup_dir)
+        run_command([*GIT_COMMAND, "push"], cwd=backup_dir)
 
 def import_variables() -> None:
     """Load and validate configuration variables from the .env file.
     
-    The function reads the configuration from '.env', checks for mandatory keys, and populates the global config dictionary.
+    The function reads the configuration from '.env', checks for mandatory keys, populates the global config dictionary
+    and API base URL, and sets the API credentials on the shared HTTP client.
     
     Raises:
         SystemExit: If the configuration file is not found or required variables are missing.
     """
-    """Load and validate configuration variables from the .env file."""
+    global api_url
     load_dotenv(override=True)
 
     required_vars = ["unimus_server_address", "unimus_api_key", "backup_type", "export_type"]
@@ -271,36 +437,45 @@ def import_variables() -> None:
             logger.error("Please provide a git password in the environment")
             sys.exit(2)
 
-def main() -> None:
-    """Main entry point for the pyunimus backup exporter.
+    config_vars = ["unimus_server_address", "unimus_api_key", "backup_type", "export_type", "git_username",
+                   "git_password", "git_email", "git_server_protocol", "git_server_address", "git_port",
+                   "git_repo_name", "git_branch"]
+    config.update({var: os.getenv(var, "") for var in config_vars})
+    config["RUN_INTERVAL"] = os.getenv("RUN_INTERVAL", "3600")
+    api_url = f"{config['unimus_server_address'].rstrip('/')}/api/v2"
+
+    CLIENT.headers.update({
+        "Accept": "application/json",
+        "Authorization": f"Bearer {config['unimus_api_key']}"
+    })
+
+def export_backups() -> None:
+    """Run a single export cycle.
+    
+    Checks the Unimus server status, refreshes the device list, retrieves backups, and optionally pushes to Git.
     
-    Sets up directories, loads configuration, checks the Unimus server status, retrieves backups, and optionally pushes to Git.
-    Exits the program if any step fails.
+    Raises:
+        SystemExit: If the Unimus server is unavailable or any step fails.
     """
-    global script_dir, backup_dir, log_file_path
-    script_dir = os.path.dirname(os.path.realpath(__file__))
-    os.chdir(script_dir)
-    backup_dir = os.path.join(script_dir, "backups")
-    Path(backup_dir).mkdir(exist_ok=True)
-
-    import_variables()
+    devices.clear()
+    ensure_device_dir.cache_clear()
 
     status = unimus_status_check()
 
     if status == "OK":
         logger.info("Getting device data")
         get_all_devices()
-        if os.getenv("backup_type") == "latest":
+        if config["backup_type"] == "latest":
             logger.info("Exporting latest backups")
             get_latest_backups()
             logger.info("Export successful")
-        elif os.getenv("backup_type") == "all":
+        elif config["backup_type"] == "all":
             logger.info("Exporting all backups")
             get_all_backups()
             logger.info("Export successful")
         else:
             logger.warning("Unknown backup type specified")
-        if os.getenv("export_type") == "git":
+        if config["export_type"] == "git":
             logger.info("Pushing to git")
             push_to_git()
             logger.info("Push successful")
@@ -311,9 +486,42 @@ def main() -> None:
         else:
             logger.error(f"Unimus server status: {status}")
             sys.exit(2)
-            
-    logger.info("Script finished")
-    logger.info(f"Sleeping for {os.getenv('RUN_INTERVAL', '3600')} seconds")
+
+def main() -> None:
+    """Main entry point for the pyunimus backup exporter.
+    
+    Sets up directories and loads configuration once, then runs an export every RUN_INTERVAL seconds until SIGTERM
+    is received, reusing the HTTP connection between runs. A failed export is logged and retried on the next run.
+    Log output is written by a background listener for the lifetime of the process.
+    """
+    global script_dir, backup_dir
+    log_listener.start()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    try:
+        script_dir = os.path.dirname(os.path.realpath(__file__))
+        os.chdir(script_dir)
+        backup_dir = os.path.join(script_dir, "backups")
+        Path(backup_dir).mkdir(exist_ok=True)
+
+        import_variables()
+        run_interval = int(config["RUN_INTERVAL"])
+
+        while not stop_event.is_set():
+            try:
+                export_backups()
+                logger.info("Script finished")
+            except SystemExit:
+                logger.error("Export failed")
+            except Exception:
+                logger.exception("Export failed")
+            if stop_event.is_set():
+                break
+            logger.info(f"Sleeping for {run_interval} seconds")
+            stop_event.wait(run_interval)
+        logger.info("Shutting down")
+    finally:
+        CLIENT.close()
+        log_listener.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,9 +1,4 @@
 #!/bin/bash
-# Wrapper script to run pyunimus at a user-defined interval
+# Wrapper script to run pyunimus; the exporter repeats every RUN_INTERVAL seconds (default 1 hour)
 
-: "${RUN_INTERVAL:=3600}"  # default to 1 hour
-
-while true; do
-  python3 /app/pyunimus.py
-  sleep "$RUN_INTERVAL"
-done
\ No newline at end of file
+exec python3 /app/pyunimus.py
\ No newline at end of file